@@ -0,0 +1,296 @@
+"""Shared plumbing for the contracts/ build scripts.
+
+build_contract.py (Soroban service) and build_freenet_contract.py (Freenet
+WASM contracts) each carried their own copies of the subprocess, copy,
+digest and optimization helpers, and the copies had already begun to drift.
+Everything both scripts need lives here once, so fixes and optimizations
+apply to every contract build.
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# linux ioctl: clone src extents into dst (btrfs/xfs reflink)
+FICLONE = 0x40049409
+
+CONTRACTS_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(CONTRACTS_DIR, "wasm")
+# Build metadata (digest sidecars etc.) lives outside OUTPUT_DIR: the release
+# workflow commits contracts/wasm/ wholesale, and committed digests would make
+# a later tag skip the build and re-publish stale WASM.
+CACHE_DIR = os.path.join(CONTRACTS_DIR, ".build-cache")
+# Common root for all contract target dirs, so build state survives across
+# invocations in one known place (and one place to point CI caching at).
+# Concurrent builds use per-contract subdirs — see cargo_env().
+SHARED_TARGET = os.environ.get(
+    "HVYM_CARGO_TARGET", os.path.join(CONTRACTS_DIR, "target-shared")
+)
+
+
+def cargo_env(target_dir: str | None = None) -> dict[str, str]:
+    """Environment for cargo children: pinned target dir, incremental
+    compilation, and sccache when it's on PATH.
+
+    cargo takes an exclusive flock on its build directory, so concurrent
+    builds must each get their own target_dir (a subdir of SHARED_TARGET) or
+    they serialize on the lock; sccache still dedupes compilation across
+    them.
+    """
+    env = dict(
+        os.environ,
+        CARGO_TARGET_DIR=target_dir or SHARED_TARGET,
+        CARGO_INCREMENTAL="1",
+    )
+    if shutil.which("sccache"):
+        env.setdefault("RUSTC_WRAPPER", "sccache")
+    return env
+
+
+def require_tools(*tools: str) -> None:
+    """Exit before any multi-second build when required tooling is missing."""
+    for tool in tools:
+        if shutil.which(tool) is None:
+            sys.exit(f"ERROR: {tool} not found on PATH")
+
+
+def quiet_default() -> bool:
+    """Suppress child stdout chatter when not attached to a terminal.
+
+    In CI the hundreds of KB of cargo/stellar progress lines serialize on
+    line buffering and bloat logs; errors still surface via stderr.
+    """
+    return not sys.stdout.isatty()
+
+
+def run(
+    cmd: list[str],
+    cwd: str | None = None,
+    env: dict[str, str] | None = None,
+    quiet: bool | None = None,
+) -> None:
+    if quiet is None:
+        quiet = quiet_default()
+    print(f"  > {' '.join(cmd)}")
+    subprocess.check_call(
+        cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL if quiet else None
+    )
+
+
+def fast_copy(src: str, dst: str) -> None:
+    """Copy src to dst preferring an O(1) reflink, then zero-copy sendfile,
+    falling back to shutil.copyfile. Callers copystat separately when the
+    mtime matters (incremental build checks)."""
+    if fcntl is not None and hasattr(os, "sendfile"):
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return
+            except OSError:
+                pass
+            try:
+                offset, size = 0, os.fstat(s.fileno()).st_size
+                while offset < size:
+                    sent = os.sendfile(d.fileno(), s.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                if offset >= size:
+                    return
+            except OSError:
+                pass
+    shutil.copyfile(src, dst)
+
+
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_digest(digest_file: str, digest: str) -> None:
+    """Atomically record a digest so a crash can't leave a stale half-write."""
+    os.makedirs(os.path.dirname(digest_file), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(digest_file), prefix=".digest.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(digest + "\n")
+        os.replace(tmp, digest_file)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def read_digest(digest_file: str) -> str | None:
+    if not os.path.isfile(digest_file):
+        return None
+    with open(digest_file) as f:
+        return f.read().strip()
+
+
+BINARYEN_VERSION_FILE = os.path.join(CACHE_DIR, "binaryen-version")
+
+# Custom sections (debug names, producers, target features) can dominate the
+# final file size; dropped by default, kept via --no-strip for debugging.
+STRIP_FLAGS = ["--strip-debug", "--strip-producers", "--strip-target-features"]
+
+
+def wasm_opt_cmd() -> list[str] | None:
+    """Resolve a wasm-opt invocation.
+
+    Prefers the pinned PyPI wheel (see requirements-dev.txt) so every
+    machine runs the same binaryen version, then falls back to whatever
+    binary is on PATH. Returns None when neither is available.
+    """
+    try:
+        import wasm_opt  # noqa: F401
+        return [sys.executable, "-m", "wasm_opt"]
+    except ImportError:
+        pass
+    if shutil.which("wasm-opt"):
+        return ["wasm-opt"]
+    return None
+
+
+def record_binaryen_version() -> None:
+    """Store the binaryen version next to the artifacts; deploy_contract.py
+    copies it into deployments.json for auditability."""
+    cmd = wasm_opt_cmd()
+    if cmd is None:
+        return
+    result = subprocess.run(cmd + ["--version"], capture_output=True, text=True)
+    version = result.stdout.strip()
+    if result.returncode == 0 and version:
+        write_digest(BINARYEN_VERSION_FILE, version)
+
+
+def optimize_wasm(output: str, strip: bool = True) -> bool:
+    """Optimize output in place by invoking wasm-opt directly.
+
+    Skips the `stellar contract build --optimize` round-trip (one fewer
+    process spawn) and pins the binaryen version when the PyPI wheel is
+    installed. strip=False keeps custom sections (e.g. the name section for
+    debugging). Returns False when no wasm-opt is available so the caller
+    can fall back to the stellar-cli bundled pass.
+    """
+    cmd = wasm_opt_cmd()
+    if cmd is None:
+        return False
+
+    tmp = output + ".tmp"
+    before = os.path.getsize(output)
+    run(cmd + [
+        "-Oz",
+        *(STRIP_FLAGS if strip else []),
+        "--enable-bulk-memory",
+        output, "-o", tmp,
+    ])
+    os.replace(tmp, output)
+    print(f"  wasm-opt: {before:,} -> {os.path.getsize(output):,} bytes")
+    record_binaryen_version()
+    return True
+
+
+def log_section_sizes(output: str) -> None:
+    """Log per-section sizes via wasm-objdump when available so CI can spot
+    which section a size regression came from. Called on the final artifact
+    after the optimize passes run."""
+    if shutil.which("wasm-objdump") is None:
+        return
+    result = subprocess.run(
+        ["wasm-objdump", "-h", output], capture_output=True, text=True
+    )
+    if result.returncode == 0:
+        print(result.stdout.rstrip())
+
+
+def strip_sections(output: str) -> None:
+    """Force-strip debug/producers/target-features custom sections.
+
+    `stellar contract build --optimize` is trusted to drop these but doesn't
+    guarantee it, and custom sections can dominate the final file size.
+    """
+    cmd = wasm_opt_cmd()
+    if cmd is None:
+        print("  wasm-opt not available; skipping strip pass", file=sys.stderr)
+        return
+
+    tmp = output + ".tmp"
+    before = os.path.getsize(output)
+    run(cmd + [
+        *STRIP_FLAGS,
+        "-Oz",
+        "--enable-bulk-memory",
+        output, "-o", tmp,
+    ])
+    os.replace(tmp, output)
+    print(f"  strip: {before:,} -> {os.path.getsize(output):,} bytes")
+    record_binaryen_version()
+
+
+def converge_optimize(output: str, strip: bool = True) -> bool:
+    """Re-run wasm-opt -Oz on output until the size stops shrinking.
+
+    The single -Oz round inside `stellar contract build --optimize` leaves a
+    few percent on the table; iterating to fixed-point recovers it. Logs the
+    size delta per iteration so CI can spot diminishing returns. strip=False
+    keeps custom sections, as in optimize_wasm. Returns True when the
+    artifact changed (callers must refresh anything derived from it, e.g.
+    the gzip sidecar).
+    """
+    cmd = wasm_opt_cmd()
+    if cmd is None:
+        print("  wasm-opt not available; skipping converge pass", file=sys.stderr)
+        return False
+
+    tmp = output + ".tmp"
+    changed = False
+    size = os.path.getsize(output)
+    while True:
+        run(cmd + [
+            "-Oz", "--converge",
+            *(STRIP_FLAGS if strip else []),
+            "--enable-bulk-memory",
+            output, "-o", tmp,
+        ])
+        new_size = os.path.getsize(tmp)
+        if new_size < size:
+            os.replace(tmp, output)
+            print(f"  converge: {size:,} -> {new_size:,} bytes")
+            size = new_size
+            changed = True
+        else:
+            os.unlink(tmp)
+            print(f"  converge: fixed-point at {size:,} bytes")
+            break
+    record_binaryen_version()
+    return changed
+
+
+def write_gzip_sidecar(output: str) -> None:
+    """Emit <output>.gz for CI archiving and mirror transfer.
+
+    Uses zopfli when installed (~10% smaller than gzip -9), stdlib gzip
+    otherwise. The on-chain upload still uses the raw WASM — Stellar RPC
+    does not accept gzip payloads.
+    """
+    with open(output, "rb") as f:
+        data = f.read()
+    try:
+        import zopfli.gzip
+        compressed = zopfli.gzip.compress(data)
+    except ImportError:
+        compressed = gzip.compress(data, compresslevel=9)
+    gz_path = output + ".gz"
+    with open(gz_path, "wb") as f:
+        f.write(compressed)
+    print(f"  gzip sidecar: {gz_path} ({len(data):,} -> {len(compressed):,} bytes)")
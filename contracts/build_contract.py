@@ -4,6 +4,7 @@
 Usage:
     python contracts/build_contract.py                 # Build + optimize
     python contracts/build_contract.py --no-optimize   # Build only (faster dev)
+    python contracts/build_contract.py --converge      # Extra wasm-opt passes
 
 Requires: stellar-cli v25.1.0 (wasm-opt included by default)
     cargo install stellar-cli --version 25.1.0 --locked
@@ -11,16 +12,50 @@ Requires: stellar-cli v25.1.0 (wasm-opt included by default)
 
 import argparse
 import os
-import subprocess
+import shutil
 import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _build_common import (
+    CACHE_DIR,
+    OUTPUT_DIR,
+    cargo_env,
+    converge_optimize,
+    fast_copy,
+    log_section_sizes,
+    optimize_wasm,
+    read_digest,
+    require_tools,
+    run,
+    sha256_file,
+    strip_sections,
+    write_digest,
+    write_gzip_sidecar,
+)
 
 CONTRACT_DIR = os.path.join(os.path.dirname(__file__), "hvym-freenet-service")
-OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "wasm")
-
-
-def run(cmd: list[str], cwd: str | None = None) -> None:
-    print(f"  > {' '.join(cmd)}")
-    subprocess.check_call(cmd, cwd=cwd)
+WASM_NAME = "hvym_freenet_service.wasm"
+# Digest of the *unoptimized* WASM from the last optimized build; used to skip
+# the wasm-opt pass when nothing changed.
+DIGEST_FILE = os.path.join(CACHE_DIR, "hvym_freenet_service.sha256")
+
+
+def build_into(tmp_dir: str, optimize: bool = False) -> str:
+    """Run stellar contract build with --out-dir and return the WASM path.
+
+    --out-dir gives a deterministic artifact location — no walk over the
+    thousands of dentries an incremental target/ dir accumulates.
+    """
+    cmd = ["stellar", "contract", "build", "--out-dir", tmp_dir]
+    if optimize:
+        cmd.append("--optimize")
+    run(cmd, cwd=CONTRACT_DIR, env=cargo_env())
+    built_wasm = os.path.join(tmp_dir, WASM_NAME)
+    if not os.path.isfile(built_wasm):
+        print(f"ERROR: WASM not found at {built_wasm}", file=sys.stderr)
+        sys.exit(1)
+    return built_wasm
 
 
 def main() -> None:
@@ -30,43 +65,90 @@ def main() -> None:
         action="store_true",
         help="Skip WASM optimization step",
     )
+    parser.add_argument(
+        "--converge",
+        action="store_true",
+        help="Iterate wasm-opt -Oz to fixed-point for extra size reduction",
+    )
+    parser.add_argument(
+        "--no-strip",
+        action="store_true",
+        help="Skip the explicit wasm-opt strip pass on optimized builds",
+    )
     args = parser.parse_args()
 
+    # Fail before the build burns seconds, not after.
+    require_tools("stellar", "cargo")
+
     if not os.path.isdir(CONTRACT_DIR):
         print(f"ERROR: Contract directory not found: {CONTRACT_DIR}", file=sys.stderr)
         sys.exit(1)
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # CLI v25.1.0: --optimize applies wasm-opt in-place; output is always
-    # <name>.wasm (no .optimized suffix like the old separate optimize command).
-    build_cmd = ["stellar", "contract", "build"]
-    if not args.no_optimize:
-        build_cmd.append("--optimize")
-        print("=== Building and optimizing hvym-freenet-service ===")
-    else:
-        print("=== Building hvym-freenet-service ===")
-
-    run(build_cmd, cwd=CONTRACT_DIR)
-
-    # The WASM is in the target dir; copy to output dir with the expected name
-    import glob as _glob
-
-    wasm_pattern = os.path.join(CONTRACT_DIR, "target", "*", "release", "hvym_freenet_service.wasm")
-    matches = _glob.glob(wasm_pattern)
-    if not matches:
-        print(f"ERROR: WASM not found matching {wasm_pattern}", file=sys.stderr)
-        sys.exit(1)
-
-    built_wasm = matches[0]
-
     if args.no_optimize:
-        output = os.path.join(OUTPUT_DIR, "hvym_freenet_service.wasm")
+        print("=== Building hvym-freenet-service ===")
+        output = os.path.join(OUTPUT_DIR, WASM_NAME)
+        with tempfile.TemporaryDirectory(dir=OUTPUT_DIR) as tmp_dir:
+            built_wasm = build_into(tmp_dir)
+            fast_copy(built_wasm, output)
+            shutil.copystat(built_wasm, output)
+        size = os.path.getsize(output)
+        print(f"=== Done: {output} ({size:,} bytes) ===")
+        return
+
+    # wasm-opt dominates rebuild time, so probe first: build *without*
+    # --optimize (cargo incremental makes this cheap), hash the result, and
+    # skip the optimize pass entirely if nothing changed.
+    output = os.path.join(OUTPUT_DIR, "hvym_freenet_service.optimized.wasm")
+    with tempfile.TemporaryDirectory(dir=OUTPUT_DIR) as tmp_dir:
+        print("=== Building hvym-freenet-service (pre-optimize probe) ===")
+        probe_wasm = build_into(tmp_dir)
+        digest = sha256_file(probe_wasm)
+
+        if read_digest(DIGEST_FILE) == digest and os.path.isfile(output):
+            size = os.path.getsize(output)
+            print(f"=== Unchanged, skipping wasm-opt: {output} ({size:,} bytes) ===")
+            converged = args.converge and converge_optimize(
+                output, strip=not args.no_strip
+            )
+            # A converge pass that shrank the WASM invalidates the old sidecar.
+            if converged or not os.path.isfile(output + ".gz"):
+                write_gzip_sidecar(output)
+            return
+
+        # The probe artifact is already the unoptimized build; keep it so
+        # the optimize step doesn't need a second stellar invocation.
+        fast_copy(probe_wasm, output)
+        shutil.copystat(probe_wasm, output)
+
+    print("=== Optimizing hvym_freenet_service.wasm ===")
+    if optimize_wasm(output, strip=not args.no_strip):
+        # Driven directly (pinned binaryen when the PyPI wheel is installed);
+        # the pass strips custom sections unless --no-strip was given.
+        if args.converge:
+            converge_optimize(output, strip=not args.no_strip)
     else:
-        output = os.path.join(OUTPUT_DIR, "hvym_freenet_service.optimized.wasm")
-
-    import shutil
-    shutil.copy2(built_wasm, output)
+        # No wasm-opt anywhere; fall back to stellar-cli's bundled pass.
+        # CLI v25.1.0: --optimize applies wasm-opt in-place; output is always
+        # <name>.wasm (no .optimized suffix like the old optimize command).
+        with tempfile.TemporaryDirectory(dir=OUTPUT_DIR) as tmp_dir:
+            built_wasm = build_into(tmp_dir, optimize=True)
+            fast_copy(built_wasm, output)
+            shutil.copystat(built_wasm, output)
+        # Don't trust --optimize to have dropped custom sections; strip
+        # defaults on for optimized (release) builds. --converge subsumes
+        # the strip pass since it carries the same flags.
+        if args.converge:
+            converge_optimize(output, strip=not args.no_strip)
+        elif not args.no_strip:
+            strip_sections(output)
+
+    # Per-section breakdown of the final artifact for CI size tracking.
+    log_section_sizes(output)
+
+    write_gzip_sidecar(output)
+    write_digest(DIGEST_FILE, digest)
 
     size = os.path.getsize(output)
     print(f"=== Done: {output} ({size:,} bytes) ===")
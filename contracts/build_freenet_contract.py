@@ -1,84 +1,238 @@
 #!/usr/bin/env python3
-"""Build a Freenet WASM contract (deposit-index, datapod, etc.).
+"""Build Freenet WASM contracts (deposit-index, datapod, etc.).
 
 Usage:
     python contracts/build_freenet_contract.py --contract deposit-index
-    python contracts/build_freenet_contract.py --contract datapod
+    python contracts/build_freenet_contract.py --contract deposit-index --contract datapod
+
+Multiple --contract flags build in parallel (one cargo process per contract).
 """
 
 import argparse
+import functools
+import hashlib
 import os
-import re
 import shutil
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _build_common import (
+    CACHE_DIR,
+    CONTRACTS_DIR,
+    OUTPUT_DIR,
+    SHARED_TARGET,
+    cargo_env,
+    fast_copy,
+    quiet_default,
+    read_digest,
+    require_tools,
+    run,
+    write_digest,
+)
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib
 
-CONTRACTS_DIR = os.path.dirname(os.path.abspath(__file__))
 WASM_TARGET = "wasm32-unknown-unknown"
-OUTPUT_DIR = os.path.join(CONTRACTS_DIR, "wasm")
 
+# Size-minimizing release profile, forced from the script via cargo's
+# --config CLI overrides (cargo 1.63+) so the checked-in Cargo.toml stays
+# untouched and the size policy lives with the build. For crates this small,
+# codegen-units=1 + lto also *speeds up* cold builds by skipping
+# cross-unit dedup work.
+SIZE_PROFILE_CONFIG = [
+    "--config", 'profile.release.opt-level="z"',
+    "--config", "profile.release.lto=true",
+    "--config", "profile.release.codegen-units=1",
+    "--config", 'profile.release.panic="abort"',
+    "--config", "profile.release.strip=true",
+]
 
-def run(cmd: list[str], cwd: str | None = None) -> None:
-    print(f"  > {' '.join(cmd)}")
-    subprocess.check_call(cmd, cwd=cwd)
 
+@functools.lru_cache(maxsize=1)
+def rustc_version() -> str:
+    result = subprocess.run(["rustc", "-V"], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else "unknown"
 
-def read_package_name(contract_dir: str) -> str:
-    """Read the package name from Cargo.toml."""
-    cargo_toml = os.path.join(contract_dir, "Cargo.toml")
-    with open(cargo_toml) as f:
-        content = f.read()
-    match = re.search(r'\[package\].*?name\s*=\s*"([^"]+)"', content, re.DOTALL)
-    if not match:
-        print(f"ERROR: Could not find package name in {cargo_toml}", file=sys.stderr)
-        sys.exit(1)
-    return match.group(1)
 
+@functools.lru_cache(maxsize=1)
+def rustc_is_nightly() -> bool:
+    return "nightly" in rustc_version()
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="Build a Freenet WASM contract")
-    parser.add_argument(
-        "--contract",
-        required=True,
-        help="Contract directory name under contracts/ (e.g. deposit-index, datapod)",
-    )
-    args = parser.parse_args()
 
-    contract_dir = os.path.join(CONTRACTS_DIR, args.contract)
-    if not os.path.isdir(contract_dir):
-        print(f"ERROR: Contract directory not found: {contract_dir}", file=sys.stderr)
-        sys.exit(1)
+def read_package_name(contract_dir: str) -> str:
+    """Read the package name from Cargo.toml.
 
+    Raises RuntimeError rather than exiting: this runs inside pool workers,
+    where SystemExit kills the process and surfaces as BrokenProcessPool.
+    """
     cargo_toml = os.path.join(contract_dir, "Cargo.toml")
-    if not os.path.isfile(cargo_toml):
-        print(f"ERROR: No Cargo.toml in {contract_dir}", file=sys.stderr)
-        sys.exit(1)
-
+    with open(cargo_toml, "rb") as f:
+        data = tomllib.load(f)
+    try:
+        return data["package"]["name"]
+    except KeyError:
+        raise RuntimeError(f"Could not find package name in {cargo_toml}") from None
+
+
+def source_digest(contract_dir: str) -> str:
+    """Hash Cargo.toml, Cargo.lock and all .rs files under src/.
+
+    Used to skip the cargo build entirely when nothing that feeds the
+    compiler has changed since the last successful build.
+    """
+    h = hashlib.blake2b()
+    # Profile overrides and the toolchain itself feed the compiler too;
+    # changing either must rebuild (a digest that survives a rustc upgrade
+    # would let a release re-publish stale WASM).
+    h.update(rustc_version().encode())
+    h.update(" ".join(SIZE_PROFILE_CONFIG).encode())
+    for manifest in ("Cargo.toml", "Cargo.lock"):
+        path = os.path.join(contract_dir, manifest)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+
+    def walk(dir_path: str) -> None:
+        entries = sorted(os.scandir(dir_path), key=lambda e: e.name)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                walk(entry.path)
+            elif entry.name.endswith(".rs"):
+                h.update(entry.name.encode())
+                with open(entry.path, "rb") as f:
+                    h.update(f.read())
+
+    src_dir = os.path.join(contract_dir, "src")
+    if os.path.isdir(src_dir):
+        walk(src_dir)
+    return h.hexdigest()
+
+
+def build_one(contract: str, cargo_jobs: int | None = None) -> tuple[str, int]:
+    """Build one contract and copy its WASM to OUTPUT_DIR.
+
+    Returns (wasm filename, size in bytes). Runs in a worker process when
+    several contracts are built at once.
+    """
+    contract_dir = os.path.join(CONTRACTS_DIR, contract)
     pkg_name = read_package_name(contract_dir)
     # WASM filename: hyphens become underscores
     wasm_filename = pkg_name.replace("-", "_") + ".wasm"
+    # Per-contract subdir of the shared target root: cargo flocks its build
+    # directory, so workers sharing one dir would serialize on the lock.
+    target_dir = os.path.join(SHARED_TARGET, contract)
     wasm_build_path = os.path.join(
-        contract_dir, "target", WASM_TARGET, "release", wasm_filename
+        target_dir, WASM_TARGET, "release", wasm_filename
     )
 
+    dest = os.path.join(OUTPUT_DIR, wasm_filename)
+    digest_file = os.path.join(CACHE_DIR, f"{wasm_filename}.blake2b")
+
+    # Skip the build when sources are unchanged since the last successful run.
+    digest = source_digest(contract_dir)
+    if read_digest(digest_file) == digest and os.path.isfile(dest):
+        size = os.path.getsize(dest)
+        print(f"=== Unchanged, skipping build: {dest} ({size:,} bytes) ===")
+        return wasm_filename, size
+
     # Step 1: Build
-    print(f"=== Building {args.contract} ({pkg_name}) ===")
-    run(
-        ["cargo", "build", "--target", WASM_TARGET, "--release"],
-        cwd=contract_dir,
-    )
+    env = cargo_env(target_dir)
+    if cargo_jobs is not None:
+        # Split cores between concurrent cargo processes so they don't
+        # oversubscribe the machine.
+        env["CARGO_BUILD_JOBS"] = str(cargo_jobs)
+    if rustc_is_nightly():
+        # Drops file/line panic metadata from the binary; stable rustc
+        # rejects -Z flags, so gate on the toolchain.
+        env["RUSTFLAGS"] = (env.get("RUSTFLAGS", "") + " -Zlocation-detail=none").strip()
+    print(f"=== Building {contract} ({pkg_name}) ===")
+    cargo_cmd = [
+        "cargo", "build", "--target", WASM_TARGET, "--release",
+        *SIZE_PROFILE_CONFIG,
+    ]
+    if quiet_default():
+        cargo_cmd.insert(2, "-q")
+    run(cargo_cmd, cwd=contract_dir, env=env)
 
     if not os.path.isfile(wasm_build_path):
-        print(f"ERROR: WASM not found at {wasm_build_path}", file=sys.stderr)
-        sys.exit(1)
+        raise RuntimeError(f"WASM not found at {wasm_build_path}")
 
     # Step 2: Copy to output
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    dest = os.path.join(OUTPUT_DIR, wasm_filename)
-    shutil.copy2(wasm_build_path, dest)
+    fast_copy(wasm_build_path, dest)
+    shutil.copystat(wasm_build_path, dest)
+    # Re-hash after the build: cargo may have generated or updated
+    # Cargo.lock, and recording the pre-build digest would guarantee one
+    # spurious rebuild on the next run.
+    write_digest(digest_file, source_digest(contract_dir))
 
     size = os.path.getsize(dest)
     print(f"=== Copied to {dest} ({size:,} bytes) ===")
+    return wasm_filename, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build Freenet WASM contracts")
+    parser.add_argument(
+        "--contract",
+        action="append",
+        required=True,
+        help="Contract directory name under contracts/ (e.g. deposit-index, datapod); "
+        "repeat to build several in parallel",
+    )
+    args = parser.parse_args()
+
+    # Fail before the build burns seconds, not after.
+    require_tools("cargo")
+    if shutil.which("rustup"):
+        # ~30 ms probe vs. a multi-second cargo failure on a missing target.
+        result = subprocess.run(
+            ["rustup", "target", "list", "--installed"],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0 and WASM_TARGET not in result.stdout.split():
+            sys.exit(
+                f"ERROR: {WASM_TARGET} target not installed; "
+                f"run: rustup target add {WASM_TARGET}"
+            )
+
+    for contract in args.contract:
+        contract_dir = os.path.join(CONTRACTS_DIR, contract)
+        if not os.path.isdir(contract_dir):
+            print(f"ERROR: Contract directory not found: {contract_dir}", file=sys.stderr)
+            sys.exit(1)
+        if not os.path.isfile(os.path.join(contract_dir, "Cargo.toml")):
+            print(f"ERROR: No Cargo.toml in {contract_dir}", file=sys.stderr)
+            sys.exit(1)
+
+    # Created once before any workers fork to avoid a mkdir race.
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Workers raise (RuntimeError, CalledProcessError) instead of exiting —
+    # SystemExit in a pool worker surfaces as a BrokenProcessPool traceback.
+    try:
+        if len(args.contract) == 1:
+            build_one(args.contract[0])
+            return
+
+        cpus = os.cpu_count() or 1
+        cargo_jobs = max(1, cpus // len(args.contract))
+        with ProcessPoolExecutor(max_workers=min(len(args.contract), cpus)) as ex:
+            results = list(
+                ex.map(
+                    functools.partial(build_one, cargo_jobs=cargo_jobs), args.contract
+                )
+            )
+    except (RuntimeError, subprocess.CalledProcessError) as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"=== Built {len(results)} contracts ===")
 
 
 if __name__ == "__main__":